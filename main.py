@@ -15,6 +15,14 @@ from src.processing import process_cps_subpixel, process_fft_phase
 from src.phase_unwrap import unwrap_surface_2d
 from src.visualization import plot_surface, plot_interferogram
 
+def masked_mean(values, mask):
+    """
+    掩膜区域均值，等价于 np.mean(values[mask])。
+    掩膜外的元素置0后求和，不生成被选中元素的紧凑临时数组；
+    与 0/1 权重点积不同，掩膜外的 NaN/inf（0·NaN = NaN）不会污染结果。
+    """
+    return np.where(mask, values, 0.0).sum() / np.count_nonzero(mask)
+
 def main_3d_simulation():
     print("🚀 开始WSI 3D表面重建 (统一架构版本)...")
     print("=" * 60)
@@ -78,7 +86,7 @@ def main_3d_simulation():
     # CPS高度转换和调平
     height_cps_nm = height_map_cps * 1e9  # 转换为纳米
     background_mask = (ground_truth_surface == 0)
-    height_cps_nm -= np.mean(height_cps_nm[background_mask])
+    height_cps_nm -= masked_mean(height_cps_nm, background_mask)
     
     # --- 5. 算法二：FFT相位重建 ---
     print(f"\n🔧 STEP 4B: 使用FFT相位算法处理...")
@@ -92,7 +100,7 @@ def main_3d_simulation():
     
     # 相位到高度转换
     height_fft_nm = unwrapped_phase * (LAMBDA_C * 1e9 / (4 * np.pi))
-    height_fft_nm -= np.mean(height_fft_nm[background_mask])
+    height_fft_nm -= masked_mean(height_fft_nm, background_mask)
     
     fft_time = time.time() - start_time
     print(f"  ✅ FFT相位算法完成, 总耗时: {fft_time:.2f}秒")
@@ -124,8 +132,13 @@ def main_3d_simulation():
         background_mask = (ground_truth_nm == 0)
         step_mask = (ground_truth_nm > 0)
         
-        step_height = np.mean(height_map_nm[step_mask]) - np.mean(height_map_nm[background_mask])
-        background_std = np.std(height_map_nm[background_mask])
+        background_mean = masked_mean(height_map_nm, background_mask)
+        step_height = masked_mean(height_map_nm, step_mask) - background_mean
+        # 只分配一个偏差临时数组：掩膜外填入均值（偏差为0），再原地平方
+        deviation = np.where(background_mask, height_map_nm, background_mean)
+        deviation -= background_mean
+        deviation *= deviation
+        background_std = np.sqrt(deviation.sum() / np.count_nonzero(background_mask))
         rmse = np.sqrt(np.mean((height_map_nm - ground_truth_nm)**2))
         
         print(f"  {algorithm_name}:")
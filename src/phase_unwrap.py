@@ -1,13 +1,98 @@
 # src/phase_unwrap.py
 import numpy as np
+from scipy.fft import dctn, idctn
 from skimage.restoration import unwrap_phase as unwrap_2d
 
-def unwrap_surface_2d(wrapped_phase_map):
+def _wrap(phase):
+    """将相位（差）包裹到 [-π, π)"""
+    return np.mod(phase + np.pi, 2 * np.pi) - np.pi
+
+def _count_residues(wrapped_phase_map):
+    """
+    统计2D包裹相位图中的残差点数量。
+    每个 2×2 闭合回路上包裹梯度之和应为0，不为0（±2π）处即为残差点。
+    """
+    p = wrapped_phase_map
+    loop_sum = (_wrap(p[:-1, 1:] - p[:-1, :-1])
+                + _wrap(p[1:, 1:] - p[:-1, 1:])
+                + _wrap(p[1:, :-1] - p[1:, 1:])
+                + _wrap(p[:-1, :-1] - p[1:, :-1]))
+    return int(np.count_nonzero(np.abs(loop_sum) > np.pi))
+
+def unwrap_itoh_2d(wrapped_phase_map):
+    """
+    基于 Itoh 条件的快速2D相位解包裹：φ_i - φ_{i-1} = W(ψ_i - ψ_{i-1})。
+    先沿第一列 (y) 积分包裹梯度，再从第一列出发沿每一行 (x) 积分。
+    无残差点时结果与路径无关，与质量引导算法只差一个 2π 整数倍的常数。
+    """
+    first_col = wrapped_phase_map[:, :1]
+    col_unwrapped = first_col[0] + np.concatenate(
+        [np.zeros((1, 1)), np.cumsum(_wrap(np.diff(first_col, axis=0)), axis=0)], axis=0
+    )
+    row_steps = np.cumsum(_wrap(np.diff(wrapped_phase_map, axis=1)), axis=1)
+    return np.concatenate([col_unwrapped, col_unwrapped + row_steps], axis=1)
+
+def unwrap_lsq_dct(wrapped_phase_map):
+    """
+    基于 DCT 的最小二乘2D相位解包裹：最小化 ‖∇φ - W(∇ψ)‖²。
+    包裹梯度的散度 ρ 满足离散 Poisson 方程 ∇²φ = ρ（Neumann 边界），
+    在 DCT 域中除以拉普拉斯算子的特征值即可一次求解，无需路径跟踪。
+    最后将解投影回与 ψ 相差 2π 整数倍的相位（同余化），保留原始测量值。
+    """
+    psi = wrapped_phase_map
+    n_y, n_x = psi.shape
+
+    # 包裹梯度及其散度（边界外梯度视为0）
+    grad_x = _wrap(np.diff(psi, axis=1))
+    grad_y = _wrap(np.diff(psi, axis=0))
+    rho = np.zeros(psi.shape)
+    rho[:, :-1] += grad_x
+    rho[:, 1:] -= grad_x
+    rho[:-1, :] += grad_y
+    rho[1:, :] -= grad_y
+
+    # DCT 域求解 Poisson 方程；直流分量（任意常数）置0
+    i = np.arange(n_y).reshape(-1, 1)
+    j = np.arange(n_x).reshape(1, -1)
+    eigenvalues = 2 * np.cos(np.pi * i / n_y) + 2 * np.cos(np.pi * j / n_x) - 4
+    eigenvalues[0, 0] = 1.0
+    rho_dct = dctn(rho, norm='ortho') / eigenvalues
+    rho_dct[0, 0] = 0.0
+    phi = idctn(rho_dct, norm='ortho')
+
+    # φ 只确定到一个任意常数（直流分量置0）；先把该常数对齐到 ψ，
+    # 否则 φ - ψ 落在 ±π 附近时，噪声会让整片区域在同余化时跳变 2π
+    phi += np.angle(np.mean(np.exp(1j * (psi - phi))))
+
+    # 同余化
+    return psi + 2 * np.pi * np.round((phi - psi) / (2 * np.pi))
+
+def unwrap_surface_2d(wrapped_phase_map, max_residues=0, method="auto"):
     """
     对2D包裹相位图进行解包裹。
+    method:
+        "auto"    - 残差点数量不超过 max_residues 时使用 Itoh 逐行积分（快速路径），
+                    否则使用 skimage 的可靠性排序算法
+        "dct"     - 始终使用 DCT 最小二乘解包裹
+        "skimage" - 使用 skimage 的可靠性排序算法
     """
-    # skimage 的 unwrap_phase 是一个强大的 2D 解包裹算法 [43, 44, 45, 46, 47]
-    print("...开始 2D 相位解包裹 (可能需要几秒钟)...")
-    unwrapped_surface = unwrap_2d(wrapped_phase_map)
-    print("...2D 解包裹完成。")
-    return unwrapped_surface
\ No newline at end of file
+    if method == "auto":
+        n_residues = _count_residues(wrapped_phase_map)
+        if n_residues <= max_residues:
+            print(f"...相位图残差点 {n_residues} 个，使用 Itoh 快速解包裹...")
+            return unwrap_itoh_2d(wrapped_phase_map)
+        print(f"...相位图残差点 {n_residues} 个，改用可靠性排序解包裹...")
+        method = "skimage"
+
+    if method == "dct":
+        print("...开始 DCT 最小二乘相位解包裹...")
+        return unwrap_lsq_dct(wrapped_phase_map)
+
+    if method == "skimage":
+        # skimage 的 unwrap_phase 是一个强大的 2D 解包裹算法 [43, 44, 45, 46, 47]
+        print("...开始 2D 相位解包裹 (可能需要几秒钟)...")
+        unwrapped_surface = unwrap_2d(wrapped_phase_map)
+        print("...2D 解包裹完成。")
+        return unwrapped_surface
+
+    raise ValueError(f"未知的解包裹方法: {method}")
@@ -5,25 +5,193 @@
 专为高噪声生产环境优化
 """
 
+import functools
+import os
+
 import numpy as np
-from scipy.fft import fft, ifft, fftfreq
+from scipy import fft as _fft_backend  # pocketfft，通过 workers 参数多线程执行批量变换
+from scipy.fft import rfftfreq
 from scipy.ndimage import gaussian_filter1d
-from scipy.signal import hilbert
+
+# GPU 后端 (可选)：process_fft_phase_gpu 需要 CuPy
+try:
+    import cupy as cp
+except ImportError:
+    cp = None
+
+# 沿Z轴的 n_y*n_x 个独立变换可在多核间并行
+_FFT_WORKERS = os.cpu_count() or 1
+
+# 稠密平滑矩阵的最大尺寸：矩阵乘的代价随 n_z² 增长（矩阵占 n_z²×4 字节），
+# 超过此长度时 O(n_z·抽头数) 的 gaussian_filter1d 更快、也不占额外内存
+_SMOOTHING_MATRIX_MAX_NZ = 1024
+
+def _rfft_axis0(stack):
+    """沿Z轴 (axis=0) 的批量实数FFT，只返回非负频率 (n_z//2+1 个频点)"""
+    return _fft_backend.rfft(stack, axis=0, workers=_FFT_WORKERS)
+
+def _analytic_signal(stack_yxz):
+    """
+    沿Z轴（最后一个轴）的解析信号，等价于 scipy.signal.hilbert(stack_yxz, axis=-1)
+    
+    负频率的单边谱权重为0：正向变换直接用 rfft 只计算非负频率的 n_z//2+1 个频点，
+    加权后由 ifft(..., n=n_z) 在内部补零到 n_z 完成逆变换。
+    输入为 (n_y, n_x, n_z) 布局（可以是转置视图），输出为Z轴连续的 C 顺序数组。
+    """
+    n_z = stack_yxz.shape[-1]
+    
+    # 单边谱权重：直流（以及偶数点数时的Nyquist）为1，其余正频率为2
+    weights = np.full(n_z // 2 + 1, 2.0, dtype=stack_yxz.dtype)
+    weights[0] = 1.0
+    if n_z % 2 == 0:
+        weights[-1] = 1.0
+    
+    half_spectrum = _fft_backend.rfft(stack_yxz, axis=-1, workers=_FFT_WORKERS)
+    half_spectrum *= weights
+    return _fft_backend.ifft(half_spectrum, n=n_z, axis=-1, workers=_FFT_WORKERS)
+
+@functools.lru_cache(maxsize=8)
+def _gaussian_smoothing_matrix(sigma, n_z, dtype=np.float32, truncate=4.0):
+    """
+    预计算并缓存沿Z轴的高斯平滑矩阵 (n_z, n_z)，精度与信号栈一致
+    
+    与 gaussian_filter1d(..., mode='nearest') 使用相同的核（半径 truncate*sigma），
+    越界的抽头按 'nearest' 边界规则累加到首尾采样点上。
+    """
+    radius = int(truncate * sigma + 0.5)
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel /= kernel.sum()
+    
+    rows = np.repeat(np.arange(n_z), offsets.size)
+    cols = np.clip(rows + np.tile(offsets, n_z), 0, n_z - 1)
+    matrix = np.zeros((n_z, n_z), dtype=dtype)
+    np.add.at(matrix, (rows, cols), np.tile(kernel, n_z).astype(dtype))
+    return matrix
+
+def _gaussian_smooth(stack_yxz, sigma):
+    """
+    沿Z轴（最后一个轴）的高斯平滑，等价于 gaussian_filter1d(stack_yxz, sigma, axis=-1, mode='nearest')
+    
+    所有像素共用一个缓存的平滑矩阵，整个栈只需一次 (n_y*n_x, n_z) × (n_z, n_z) 矩阵乘。
+    矩阵乘由 BLAS 自身多线程执行，无需再按像素分块并行（叠加线程池只会造成线程过载）。
+    n_z 超过 _SMOOTHING_MATRIX_MAX_NZ 时直接使用 gaussian_filter1d。
+    """
+    n_z = stack_yxz.shape[-1]
+    if n_z > _SMOOTHING_MATRIX_MAX_NZ:
+        return gaussian_filter1d(stack_yxz, sigma, axis=-1, mode='nearest')
+    matrix = _gaussian_smoothing_matrix(float(sigma), n_z, stack_yxz.dtype)
+    return (stack_yxz.reshape(-1, n_z) @ matrix.T).reshape(stack_yxz.shape)
+
+# 载波频率搜索时每个方向最多使用的像素数（载波由光源决定，全图一致）
+_CARRIER_SEARCH_PIXELS = 32
+
+@functools.lru_cache(maxsize=8)
+def _dft_kernel(n_z, k, dtype=np.float32):
+    """
+    预计算并缓存第 k 个DFT频点的核 (2, n_z)：第一行 cos(2πkn/n_z)，第二行 -sin(2πkn/n_z)
+    批量处理同尺寸信号栈时，每次调用不再重新计算三角函数。
+    """
+    angle = 2 * np.pi * k * np.arange(n_z) / n_z
+    return np.stack([np.cos(angle), -np.sin(angle)]).astype(dtype)
+
+def _dft_bin_axis0(stack, k, xp=np):
+    """
+    沿Z轴只计算第 k 个DFT频点: X[k] = Σ_n x[n]·exp(-2πi·k·n/n_z)
+    
+    对全部像素是两次 (n_z,) × (n_z, n_y*n_x) 的矩阵-向量乘，
+    无需为只读取一个频点而计算完整的频谱。xp 为数组模块 (numpy 或 cupy)。
+    """
+    n_z = stack.shape[0]
+    flat = stack.reshape(n_z, -1)
+    # DFT核与信号栈同精度，避免 float32 栈被提升为 float64 副本
+    kernel = xp.asarray(_dft_kernel(n_z, int(k), np.dtype(flat.dtype)))
+    spectrum_real = kernel[0] @ flat
+    spectrum_imag = kernel[1] @ flat
+    return (spectrum_real + 1j * spectrum_imag).reshape(stack.shape[1:])
+
+def _select_carrier_bin(mean_spectrum, freqs, n_z):
+    """
+    在 rfft 平均幅度谱中找到正频率载波的绝对索引
+    
+    参数:
+        mean_spectrum: 各频点在全部（或抽样）像素上的平均幅度 (n_z//2+1,)
+        freqs: rfftfreq 频率轴 (n_z//2+1,)
+        n_z: Z轴采样点数
+        
+    返回:
+        center_idx_absolute: 载波在 rfft 频谱中的索引
+    """
+    # 我们只关心正频率部分 (k > 0)；偶数点数时的Nyquist频点相位恒为0或π，同样排除
+    positive_freq_mask = (freqs > 0)
+    if n_z % 2 == 0:
+        positive_freq_mask[-1] = False
+    
+    # 如果没有正频率 (例如采样点太少)，则出错
+    if not np.any(positive_freq_mask):
+        raise ValueError("无法找到正载波频率，请检查Z轴采样")
+    
+    # 找到正频率中的峰值索引（相对于掩码）
+    center_idx_relative = np.argmax(mean_spectrum[positive_freq_mask])
+    
+    # 将其映射回FFT数组的绝对索引（rfft 与 fft 的非负频点索引一致）
+    positive_indices = np.where(positive_freq_mask)[0]
+    return positive_indices[center_idx_relative]
 
 def _parabolic_subpixel(vm1, v0, vp1):
     """
-    基于二次曲线拟合的亚像素峰值偏移量计算
+    基于二次曲线拟合的亚像素峰值偏移量计算（支持逐像素数组输入）
     
     参数:
-        vm1, v0, vp1: 峰值附近三个点的包络值
+        vm1, v0, vp1: 峰值附近三个点的包络值（标量或同形数组）
         
     返回:
-        shift: 亚像素偏移量 (-0.5 到 0.5)
+        shift: 亚像素偏移量 (-0.5 到 0.5)，分母过小时为0
+    """
+    denom = vm1 - 2 * v0 + vp1
+    valid = np.abs(denom) >= 1e-12
+    safe_denom = np.where(valid, denom, 1.0)
+    return np.where(valid, 0.5 * (vm1 - vp1) / safe_denom, 0.0)
+
+def _subpixel_peak(envelope_smooth, envelope, z_scan, peak_idx):
     """
-    denom = (vm1 - 2 * v0 + vp1)
-    if np.abs(denom) < 1e-12:
-        return 0.0
-    return 0.5 * (vm1 - vp1) / denom
+    亚像素峰值定位（全像素向量化实现）
+    
+    参数:
+        envelope_smooth: 平滑后的包络 (n_y, n_x, n_z)
+        envelope: 原始包络 (n_y, n_x, n_z)
+        z_scan: Z轴扫描位置数组 (n_z,)
+        peak_idx: 平滑包络的整数峰值索引 (n_y, n_x)
+        
+    返回:
+        height_map, coherence_map: (n_y, n_x)
+    """
+    n_z = envelope_smooth.shape[-1]
+    
+    # 边界保护：峰值在边界的像素不做拟合，直接使用整数位置
+    at_edge = (peak_idx <= 0) | (peak_idx >= n_z - 1)
+    i = np.clip(peak_idx, 1, n_z - 2)
+    
+    # 亚像素拟合：一次 gather 取出所有像素峰值附近的三个点 -> (n_y, n_x, 3)
+    # 之后只在这个紧凑数组上计算，不再访问完整的 (n_y, n_x, n_z) 包络
+    env3 = np.take_along_axis(envelope_smooth, np.stack([i - 1, i, i + 1], axis=-1), axis=-1)
+    vm1, v0, vp1 = np.moveaxis(env3, -1, 0)  # 峰值前一个点、峰值点、峰值后一个点
+    
+    shift = np.where(at_edge, 0.0, _parabolic_subpixel(vm1, v0, vp1))
+    float_idx = np.where(at_edge, peak_idx, i) + shift  # 浮点数索引
+    
+    # 两点线性插值：float_idx 落在 [i0, i0+1] 之间，同样只 gather 两个采样点
+    i0 = np.clip(np.floor(float_idx).astype(np.intp), 0, n_z - 2)
+    w = float_idx - i0
+    env2 = np.take_along_axis(envelope, np.stack([i0, i0 + 1], axis=-1), axis=-1)
+    
+    height_map = (1 - w) * z_scan[i0] + w * z_scan[i0 + 1]
+    coherence_map = (1 - w) * env2[..., 0] + w * env2[..., 1]
+    
+    # 边界像素的相干度取平滑包络在整数峰值处的值（已包含在 env3 中）
+    edge_value = np.take_along_axis(env3, (peak_idx - i + 1)[..., np.newaxis], axis=-1)[..., 0]
+    coherence_map = np.where(at_edge, edge_value, coherence_map)
+    return height_map, coherence_map
 
 def process_cps_subpixel(stack, z_scan, smooth_sigma=8.0):
     """
@@ -40,46 +208,26 @@ def process_cps_subpixel(stack, z_scan, smooth_sigma=8.0):
         coherence_map: 相干度图 (n_y, n_x)
     """
     n_z, n_y, n_x = stack.shape
-    height_map = np.zeros((n_y, n_x))
-    coherence_map = np.zeros((n_y, n_x))
+    stack = np.asarray(stack, dtype=np.float32)  # 单精度：Hilbert 得到 complex64
     
     print(f"🔧 开始CPS算法处理: 栈尺寸{stack.shape}, 平滑sigma={smooth_sigma}")
     
     # 1. 沿Z轴计算解析信号和包络
-    analytic_stack = hilbert(stack, axis=0)
+    # 内部使用 (n_y, n_x, n_z) 布局：Z轴连续，后续FFT、平滑和 argmax 都是步长为1的访问。
+    # 转置只是视图，在第一次 rfft 时顺带完成重排，不额外复制。
+    analytic_stack = _analytic_signal(stack.transpose(1, 2, 0))
     envelope = np.abs(analytic_stack)
     
     # 2. 强力平滑包络 - 这是抗噪声的关键！
-    envelope_smooth = gaussian_filter1d(envelope, sigma=smooth_sigma, axis=0, mode='nearest')
+    envelope_smooth = _gaussian_smooth(envelope, smooth_sigma)
     
     # 3. 寻找整数峰值位置
-    peak_idx_int = np.argmax(envelope_smooth, axis=0)
+    peak_idx_int = np.argmax(envelope_smooth, axis=-1)
     
     # 4. 亚像素插值 - 消除量化误差的关键步骤
-    z_indices = np.arange(n_z)
-    
-    for yi in range(n_y):
-        for xi in range(n_x):
-            i = peak_idx_int[yi, xi]
-            
-            # 边界保护：如果峰值在边界，直接使用整数位置
-            if i <= 0 or i >= n_z - 1:
-                height_map[yi, xi] = z_scan[i]
-                coherence_map[yi, xi] = envelope_smooth[i, yi, xi]
-                continue
-            
-            # 亚像素拟合：获取峰值附近三个点
-            vm1 = envelope_smooth[i - 1, yi, xi]  # 峰值前一个点
-            v0 = envelope_smooth[i, yi, xi]       # 峰值点  
-            vp1 = envelope_smooth[i + 1, yi, xi]  # 峰值后一个点
-            
-            # 计算亚像素偏移量
-            shift = _parabolic_subpixel(vm1, v0, vp1)
-            float_idx = i + shift  # 浮点数索引
-            
-            # 线性插值得到精确高度
-            height_map[yi, xi] = np.interp(float_idx, z_indices, z_scan)
-            coherence_map[yi, xi] = np.interp(float_idx, z_indices, envelope[:, yi, xi])
+    height_map, coherence_map = _subpixel_peak(
+        envelope_smooth, envelope, np.asarray(z_scan, dtype=np.float64), peak_idx_int
+    )
     
     print("✅ CPS算法处理完成")
     return height_map, coherence_map
@@ -101,6 +249,7 @@ def process_fft_phase(stack, z_scan, smooth_sigma=10.0, band_frac=0.15):
     """
     print(f"🔧 开始FFT相位算法处理 (Takeda 修正版): 栈尺寸{stack.shape}")
     n_z, n_y, n_x = stack.shape
+    stack = np.asarray(stack, dtype=np.float32)  # 单精度：rfft 得到 complex64
     
     if n_z < 3:
         raise ValueError("需要至少3个Z轴采样点")
@@ -108,37 +257,69 @@ def process_fft_phase(stack, z_scan, smooth_sigma=10.0, band_frac=0.15):
     # 1. 计算Z轴步长 (dz)
     dz = float(z_scan[1] - z_scan[0])
     
-    # 2. 沿Z轴进行FFT
-    stack_fft = fft(stack, axis=0)
-    freqs = fftfreq(n_z, d=dz)
+    # 2. 沿Z轴进行实数FFT（仅在稀疏采样的像素子集上，用于定位载波）
+    # 信号栈为实数，负频率与正频率共轭，rfft 只计算非负频率的一半频谱
+    step_y = max(1, n_y // _CARRIER_SEARCH_PIXELS)
+    step_x = max(1, n_x // _CARRIER_SEARCH_PIXELS)
+    stack_fft = _rfft_axis0(stack[:, ::step_y, ::step_x])
+    freqs = rfftfreq(n_z, d=dz)
     
     # 3. 找到正频率的载波频率 (关键步骤)
-    # 我们只关心正频率部分 (k > 0)，因为负频率是共轭的
-    positive_freq_mask = (freqs > 0)
-    
-    # 如果没有正频率 (例如采样点太少)，则出错
-    if not np.any(positive_freq_mask):
-        raise ValueError("无法找到正载波频率，请检查Z轴采样")
-        
-    # 计算正频率部分的平均频谱
-    mean_spectrum = np.mean(np.abs(stack_fft[positive_freq_mask, :, :]), axis=(1, 2))
-    
-    # 找到正频率中的峰值索引（相对于掩码）
-    center_idx_relative = np.argmax(mean_spectrum)
-    
-    # 将其映射回原始FFT数组的绝对索引
-    positive_indices = np.where(positive_freq_mask)[0]
-    center_idx_absolute = positive_indices[center_idx_relative]
+    mean_spectrum = np.mean(np.abs(stack_fft), axis=(1, 2))
+    center_idx_absolute = _select_carrier_bin(mean_spectrum, freqs, n_z)
     
     print(f"  ...检测到载波频率索引: {center_idx_absolute} (对应频率: {freqs[center_idx_absolute]:.2f})")
     
     # 4. 提取该频率下的相位和相干度 (核心)
+    # 只对全部像素直接计算载波这一个DFT频点
+    carrier_spectrum = _dft_bin_axis0(stack, center_idx_absolute)
     
     # 包裹相位图 = 该载波频率分量的相位角
-    wrapped_phase_map = np.angle(stack_fft[center_idx_absolute, :, :])
+    wrapped_phase_map = np.angle(carrier_spectrum)
     
     # 相干度图 = 该载波频率分量的幅度
-    coherence_map = np.abs(stack_fft[center_idx_absolute, :, :])
+    coherence_map = np.abs(carrier_spectrum)
 
     print("✅ FFT相位算法 (Takeda 修正版) 处理完成")
-    return wrapped_phase_map, coherence_map
\ No newline at end of file
+    return wrapped_phase_map, coherence_map
+
+def process_fft_phase_gpu(stack, z_scan, smooth_sigma=10.0, band_frac=0.15):
+    """
+    算法二的GPU版本：与 process_fft_phase 相同的流程，在 CuPy (cuFFT) 上执行
+    （适用于批量离线计量，需要 NVIDIA GPU 和 cupy）
+    
+    参数与返回值同 process_fft_phase；信号栈以 float32 一次性上传到显存，
+    结果只在最后拷回主机内存。
+    """
+    if cp is None:
+        raise ImportError("process_fft_phase_gpu 需要安装 cupy")
+    
+    print(f"🔧 开始FFT相位算法处理 (GPU): 栈尺寸{stack.shape}")
+    n_z, n_y, n_x = stack.shape
+    
+    if n_z < 3:
+        raise ValueError("需要至少3个Z轴采样点")
+
+    # 1. 计算Z轴步长 (dz)，并上传信号栈
+    dz = float(z_scan[1] - z_scan[0])
+    stack_d = cp.asarray(stack, dtype=cp.float32)
+    
+    # 2. 在抽样像素上做 rfft 定位载波（cuFFT 以单个批量计划完成）
+    step_y = max(1, n_y // _CARRIER_SEARCH_PIXELS)
+    step_x = max(1, n_x // _CARRIER_SEARCH_PIXELS)
+    stack_fft = cp.fft.rfft(stack_d[:, ::step_y, ::step_x], axis=0)
+    freqs = rfftfreq(n_z, d=dz)
+    
+    # 3. 平均频谱只有 n_z//2+1 个值，拷回主机选择载波
+    mean_spectrum = cp.asnumpy(cp.mean(cp.abs(stack_fft), axis=(1, 2)))
+    center_idx_absolute = _select_carrier_bin(mean_spectrum, freqs, n_z)
+    
+    print(f"  ...检测到载波频率索引: {center_idx_absolute} (对应频率: {freqs[center_idx_absolute]:.2f})")
+    
+    # 4. 提取该频率下的相位和相干度
+    carrier_spectrum = _dft_bin_axis0(stack_d, center_idx_absolute, xp=cp)
+    wrapped_phase_map = cp.asnumpy(cp.angle(carrier_spectrum))
+    coherence_map = cp.asnumpy(cp.abs(carrier_spectrum))
+
+    print("✅ FFT相位算法 (GPU) 处理完成")
+    return wrapped_phase_map, coherence_map
@@ -1,18 +1,79 @@
 # src/visualization.py
 import os
 import sys
+import functools
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import matplotlib
+
+# 脚本 (main.py) 只保存 PNG：固定使用非交互的 Agg 后端，跳过 GUI 工具包的初始化。
+# 在 Jupyter 内核中保留 Notebook 的 inline 后端，图像仍可直接显示。
+_IN_NOTEBOOK = "ipykernel" in sys.modules
+if not _IN_NOTEBOOK:
+    matplotlib.use("Agg", force=True)
 import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D  # noqa: F401
+from matplotlib.figure import Figure
+from matplotlib.colors import LightSource, Normalize
+from matplotlib.cm import ScalarMappable
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# 输出目录只在 utils 导入时解析一次（项目根下的 data/example_output）
+from .utils import OUTPUT_DIR
+
+# 脚本批量保存时复用的 Figure（已绑定 Agg 画布），键为 figsize
+_FIGURE_CACHE = {}
+
+def _get_figure(figsize, projection=None):
+    """
+    获取用于保存图像的 (fig, ax)。
+    脚本中按 figsize 缓存一个 Agg 画布，每次调用只清空并重建 Axes，
+    避免逐帧重新构建 Figure/画布/渲染器；Notebook 中仍新建 pyplot 图以便 inline 显示。
+    (3D Axes 在 cla() 后会沿用上一帧的投影状态，导致 tight_layout 布局漂移，故重建 Axes。)
+    """
+    if _IN_NOTEBOOK:
+        fig = plt.figure(figsize=figsize)
+        return fig, fig.add_subplot(111, projection=projection)
+
+    fig = _FIGURE_CACHE.get(figsize)
+    if fig is None:
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        _FIGURE_CACHE[figsize] = fig
+    else:
+        fig.clear()
+        # tight_layout 会改写子图边距，复用前恢复默认值，保证每帧布局一致
+        fig.subplots_adjust(**{k: matplotlib.rcParams[f"figure.subplot.{k}"]
+                               for k in ("left", "right", "bottom", "top")})
+    return fig, fig.add_subplot(111, projection=projection)
+
+def _savefig(fig, output_path, dpi):
+    """
+    保存图像；PNG 使用 zlib 压缩等级1（默认6），文件略大但编码明显更快。
+    Agg 画布的 print_png 本身就是 draw() 后把 buffer_rgba() 直接交给 PIL 编码，
+    因此沿用 savefig 即可，同时保留 dpi 处理。
+    """
+    if output_path.lower().endswith(".png"):
+        fig.savefig(output_path, dpi=dpi, pil_kwargs={"compress_level": 1})
+    else:
+        fig.savefig(output_path, dpi=dpi)
+
+def _show_or_close(fig):
+    """Notebook 中显示图像；Agg 后端下无法显示，直接关闭以释放内存"""
+    if _IN_NOTEBOOK:
+        plt.show()
+    else:
+        plt.close(fig)
 
 # --- 这是修复了 Bug 的 Cell 2 函数 ---
-def plot_stack_section(stack, title="WSI stack section", Z_SCAN=None):
+def plot_stack_section(stack, title="WSI stack section", Z_SCAN=None, fname=None):
     """
     显示 WSI 信号栈在 z-x 的切片（取中间 y 行）。
     stack: (n_z, n_y, n_x)
+    fname: 给定时保存到输出目录；脚本中 (Agg 后端) 无法显示图像，需通过它保存
     """
     n_z, n_y, n_x = stack.shape # 需要先获取 x 轴的 'n_x'
-    plt.figure(figsize=(10, 4))
+    fig = plt.figure(figsize=(10, 4))
     
     # 根据 Z_SCAN 范围设置 y 轴刻度
     if Z_SCAN is not None:
@@ -34,58 +95,185 @@ def plot_stack_section(stack, title="WSI stack section", Z_SCAN=None):
     plt.title(title)
     plt.xlabel("X Pixel")
     plt.colorbar(label="Intensity (a.u.)")
-    plt.show() # 在 Notebook 中使用 plt.show()
+    if fname is not None:
+        output_path = os.path.join(OUTPUT_DIR, fname)
+        _savefig(fig, output_path, dpi=300)
+        print(f"💾 信号栈切片图已保存: {output_path}")
+    elif not _IN_NOTEBOOK:
+        warnings.warn("plot_stack_section: 非 Notebook 环境使用 Agg 后端，图像无法显示；"
+                      "请传入 fname 保存图像", stacklevel=2)
+    _show_or_close(fig)
 
 # --- 你的其他绘图函数 ---
 
-def get_output_dir():
-    """ 智能获取和创建输出目录 """
-    # 假设 Notebook 在 'notebooks/' 文件夹中
-    proj_root = os.path.abspath(os.path.join(os.getcwd(), '..'))
-    if 'notebooks' not in proj_root:
-        proj_root = os.getcwd() # 备用方案
-        
-    output_dir = os.path.join(proj_root, "data", "example_output")
-    os.makedirs(output_dir, exist_ok=True)
-    return output_dir
-
-OUTPUT_DIR = get_output_dir()
-
-def plot_interferogram(z, I_ideal, I_noisy, fname="interferogram.png"):
-    """绘制干涉图"""
-    plt.figure(figsize=(8,4))
-    plt.plot(z*1e6, I_ideal, 'b--', label="理想信号", alpha=0.7)
-    plt.plot(z*1e6, I_noisy, 'r-', label="含噪信号", alpha=0.8)
-    plt.xlabel("Scan Position (μm)")
-    plt.ylabel("Intensity (a.u.)")
-    plt.title("White Light Interferogram")
-    plt.legend()
-    plt.tight_layout()
+# 脚本中复用的干涉图 (fig, ax, 理想曲线, 含噪曲线)，逐帧只更新曲线数据
+_INTERFEROGRAM_ARTISTS = None
+
+def _interferogram_artists():
+    """
+    返回 (fig, ax, line_ideal, line_noisy)。
+    脚本中只在第一次调用时创建坐标轴、曲线与图例，之后复用，由调用方 set_data 更新数据；
+    Notebook 中每次新建 pyplot 图以便 inline 显示。
+    """
+    global _INTERFEROGRAM_ARTISTS
+    if not _IN_NOTEBOOK and _INTERFEROGRAM_ARTISTS is not None:
+        return _INTERFEROGRAM_ARTISTS
+
+    if _IN_NOTEBOOK:
+        fig = plt.figure(figsize=(8, 4))
+    else:
+        fig = Figure(figsize=(8, 4))
+        FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    # 只栅格化数据曲线，导出 PDF/SVG 时坐标轴与文字仍保持矢量
+    line_ideal, = ax.plot([], [], 'b--', label="理想信号", alpha=0.7, rasterized=True)
+    line_noisy, = ax.plot([], [], 'r-', label="含噪信号", alpha=0.8, rasterized=True)
+    ax.set_xlabel("Scan Position (μm)")
+    ax.set_ylabel("Intensity (a.u.)")
+    ax.set_title("White Light Interferogram")
+    ax.legend()
+
+    artists = (fig, ax, line_ideal, line_noisy)
+    if not _IN_NOTEBOOK:
+        _INTERFEROGRAM_ARTISTS = artists
+    return artists
+
+def _minmax_decimate(x, y, n_buckets):
+    """
+    最小/最大值抽取：把曲线分成至少 n_buckets 段，每段只保留最小值与最大值两个点（按原顺序），
+    栅格化后的包络与原曲线一致，但 Agg 路径长度从采样点数降为约 2×像素列数。
+    每段长度向下取整，保证每段不超过一个像素列；末尾不足一段的点原样保留。
+    """
+    bucket = max(1, x.size // n_buckets)
+    n_full = x.size // bucket
+    n_used = n_full * bucket
+    y_buckets = y[:n_used].reshape(n_full, bucket)
+    i_min = y_buckets.argmin(axis=1)
+    i_max = y_buckets.argmax(axis=1)
+    start = np.arange(n_full) * bucket
+    idx = np.stack([start + np.minimum(i_min, i_max), start + np.maximum(i_min, i_max)], axis=1).ravel()
+    idx = np.concatenate([idx, np.arange(n_used, x.size)])
+    return x[idx], y[idx]
+
+# 干涉图的保存分辨率
+_INTERFEROGRAM_DPI = 300
+
+def plot_interferogram(z, I_ideal, I_noisy, fname="interferogram.png", verbose=True):
+    """绘制干涉图；verbose=False 时不打印保存路径（批量绘制时使用）"""
+    # 绘图只需像素级精度：统一为 float32，减半送入 Agg 的数据量
+    z_um = np.asarray(z, dtype=np.float32) * np.float32(1e6)  # 扫描位置换算为 μm，两条曲线共用
+    I_ideal = np.asarray(I_ideal, dtype=np.float32)
+    I_noisy = np.asarray(I_noisy, dtype=np.float32)
+    fig, ax, line_ideal, line_noisy = _interferogram_artists()
+
+    # 先用完整数据确定坐标范围和布局
+    line_ideal.set_data(z_um, I_ideal)
+    line_noisy.set_data(z_um, I_noisy)
+    ax.relim()
+    ax.autoscale_view()
+    fig.tight_layout()
+
+    # 采样点数超过坐标轴在输出图中的像素列数的2倍时，每个像素列只保留最小/最大值两个点；
+    # 坐标范围已由完整数据确定，替换数据后不再 relim
+    n_columns = int(ax.get_window_extent().width * _INTERFEROGRAM_DPI / fig.dpi)
+    if z_um.size > 2 * n_columns:
+        line_ideal.set_data(*_minmax_decimate(z_um, I_ideal, n_columns))
+        line_noisy.set_data(*_minmax_decimate(z_um, I_noisy, n_columns))
     
     output_path = os.path.join(OUTPUT_DIR, fname)
-    plt.savefig(output_path, dpi=300, bbox_inches='tight')
-    print(f"💾 干涉图已保存: {output_path}")
-    plt.show() # 在 Notebook 中使用 plt.show()
-
-def plot_surface(x_pixels, y_pixels, height_map, fname="reconstructed_surface.png"):
-    """绘制三维表面图"""
-    X, Y = np.meshgrid(x_pixels, y_pixels)
-    fig = plt.figure(figsize=(8,6))
-    ax = fig.add_subplot(111, projection='3d')
+    _savefig(fig, output_path, dpi=_INTERFEROGRAM_DPI)
+    if verbose:
+        print(f"💾 干涉图已保存: {output_path}")
+    if _IN_NOTEBOOK:
+        plt.show()
+
+# plot_surface 每个方向最多绘制的网格面数；大图按此增大步长，限制 Poly3DCollection 的多边形总数
+_SURFACE_MAX_FACES_PER_AXIS = 200
+
+def plot_surface(x_pixels, y_pixels, height_map, fname="reconstructed_surface.png", dpi=150, verbose=True):
+    """绘制三维表面图（dpi=150 即 1200×900 像素，足够常规显示；需要印刷质量时可传入 300）"""
+    # plot_surface 按行切取网格块构建多边形；转置/FFT 结果可能是 F 序，先转为行主序 float32
+    height_map = np.ascontiguousarray(height_map, dtype=np.float32)
+    # 稀疏网格：X 为 (1, n_x)、Y 为 (n_y, 1)，由 plot_surface 内部广播，无需两份完整 N×M 数组
+    X, Y = np.meshgrid(x_pixels, y_pixels, sparse=True)
+    fig, ax = _get_figure((8, 6), projection='3d')
     
     # 限制显示范围，突出台阶特征
     display_data = np.clip(height_map, 
                            np.percentile(height_map, 1), 
                            np.percentile(height_map, 99))
     
-    surf = ax.plot_surface(X, Y, display_data, cmap='viridis', linewidth=0, antialiased=False, rstride=3, cstride=3)
+    # 步长至少为3（小图保持原有显示密度），大图按面数上限取步长
+    n_y, n_x = height_map.shape
+    rstride = max(3, -(-n_y // _SURFACE_MAX_FACES_PER_AXIS))
+    cstride = max(3, -(-n_x // _SURFACE_MAX_FACES_PER_AXIS))
+    # 保留 cmap：按面的平均高度一次性向量化映射颜色；改传预计算的 facecolors 反而更慢
+    # （plot_surface 会逐面在 Python 中收集颜色，并同时设为边颜色）
+    surf = ax.plot_surface(X, Y, display_data, cmap='viridis', linewidth=0, antialiased=False, rstride=rstride, cstride=cstride, rasterized=True)
     ax.set_xlabel("X Pixel")
     ax.set_ylabel("Y Pixel")
     ax.set_zlabel("Height (nm)")
     ax.set_title("Reconstructed Surface")
-    plt.tight_layout()
+    fig.tight_layout()
     
     output_path = os.path.join(OUTPUT_DIR, fname)
-    plt.savefig(output_path, dpi=300, bbox_inches='tight')
-    print(f"💾 重建表面图已保存: {output_path}")
-    plt.show() # 在 Notebook 中使用 plt.show()
\ No newline at end of file
+    _savefig(fig, output_path, dpi=dpi)
+    if verbose:
+        print(f"💾 重建表面图已保存: {output_path}")
+    if _IN_NOTEBOOK:
+        plt.show()
+
+def _init_plot_worker():
+    """子进程初始化：固定使用 Agg 且不显示（Notebook 中 fork 出的子进程也不能 inline 显示）"""
+    global _IN_NOTEBOOK
+    _IN_NOTEBOOK = False
+    matplotlib.use("Agg", force=True)
+
+def plot_many(zs, Is_ideal, Is_noisy, fnames, max_workers=None):
+    """
+    批量绘制并保存多帧干涉图。
+    matplotlib 渲染受 GIL 限制，多线程无效，因此用进程池让每个核独立渲染一帧，
+    每帧仍由 plot_interferogram 完成（不逐帧打印路径）。max_workers 默认取 CPU 核数，为1时直接串行。
+    """
+    plot_frame = functools.partial(plot_interferogram, verbose=False)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers == 1 or len(fnames) <= 1:
+        for z, I_ideal, I_noisy, fname in zip(zs, Is_ideal, Is_noisy, fnames):
+            plot_frame(z, I_ideal, I_noisy, fname)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_plot_worker) as executor:
+            # 取回结果以便子进程中的异常在这里抛出
+            list(executor.map(plot_frame, zs, Is_ideal, Is_noisy, fnames))
+    print(f"💾 {len(fnames)} 张干涉图已保存到: {OUTPUT_DIR}")
+
+def plot_surface_fast(x_pixels, y_pixels, height_map, fname="reconstructed_surface_fast.png", dpi=150, verbose=True):
+    """
+    绘制俯视的山体阴影 (hill-shading) 伪彩色高度图。
+    与 plot_surface 显示相同的高度信息，但只上传一张 RGB 图像，
+    没有逐网格面的 Poly3DCollection，适合大尺寸高度图。
+    """
+    height_map = np.ascontiguousarray(height_map, dtype=np.float32)
+    fig, ax = _get_figure((8, 6))
+
+    # 限制显示范围，突出台阶特征
+    vmin, vmax = np.percentile(height_map, [1, 99])
+    display_data = np.clip(height_map, vmin, vmax)
+
+    norm = Normalize(vmin=vmin, vmax=vmax)
+    ls = LightSource(azdeg=315, altdeg=45)
+    rgb = ls.shade(display_data, cmap=plt.cm.viridis, norm=norm, blend_mode='soft')
+    extent = [x_pixels[0], x_pixels[-1], y_pixels[0], y_pixels[-1]]
+    ax.imshow(rgb, origin='lower', extent=extent, interpolation='nearest')
+    fig.colorbar(ScalarMappable(norm=norm, cmap='viridis'), ax=ax, label="Height (nm)")
+    ax.set_xlabel("X Pixel")
+    ax.set_ylabel("Y Pixel")
+    ax.set_title("Reconstructed Surface")
+    fig.tight_layout()
+
+    output_path = os.path.join(OUTPUT_DIR, fname)
+    _savefig(fig, output_path, dpi=dpi)
+    if verbose:
+        print(f"💾 重建表面图已保存: {output_path}")
+    if _IN_NOTEBOOK:
+        plt.show()